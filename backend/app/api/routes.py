@@ -4,9 +4,9 @@ import asyncio
 from datetime import datetime, timezone
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Request, UploadFile, status
 from pydantic import BaseModel, Field
-from sqlalchemy import select
+from sqlalchemy import Row, func, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import get_settings
@@ -14,11 +14,13 @@ from app.core.database import get_db
 from app.core.security import create_access_token, get_current_user, hash_token
 from app.models.models import AccessToken, Challenge, VerificationAttempt
 from app.services.challenge import create_challenge
-from app.services.vision import analyze_frames
+from app.services.vision import analyze_frames, decode_base64_frames, is_static_sequence
 
 settings = get_settings()
 router = APIRouter(prefix="/api", tags=["verification"])
 
+MAX_VERIFY_FRAMES = 60
+
 
 # ──────────────────────── Request/Response Schemas ────────────────────────
 
@@ -31,7 +33,9 @@ class ChallengeResponse(BaseModel):
 
 class VerifyRequest(BaseModel):
     challenge_id: str
-    frames: List[str] = Field(..., min_length=1, max_length=60, description="Base64-encoded frames")
+    frames: List[str] = Field(
+        ..., min_length=1, max_length=MAX_VERIFY_FRAMES, description="Base64-encoded frames"
+    )
 
 
 class StepResult(BaseModel):
@@ -98,8 +102,9 @@ async def generate_challenge(db: AsyncSession = Depends(get_db)):
     Returns a unique challenge ID with steps to perform and an expiration time.
     Each challenge can only be used once.
     """
-    challenge = await create_challenge(db)
-    expires_in = int((challenge.expires_at - datetime.now(timezone.utc)).total_seconds())
+    now = datetime.now(timezone.utc)
+    challenge = await create_challenge(db, now=now)
+    expires_in = int((challenge.expires_at - now).total_seconds())
 
     return ChallengeResponse(
         challenge_id=str(challenge.id),
@@ -109,40 +114,52 @@ async def generate_challenge(db: AsyncSession = Depends(get_db)):
     )
 
 
-@router.post("/verify", response_model=VerifyResponse)
-async def verify_liveness(
-    body: VerifyRequest,
-    request: Request,
-    db: AsyncSession = Depends(get_db),
-):
-    """Verify liveness by analyzing frames against a challenge.
-    
-    Accepts a challenge_id and a sequence of base64-encoded video frames.
-    Runs the CV pipeline to detect challenge actions in temporal order.
-    On success, issues a short-lived JWT access token.
+async def _claim_challenge(db: AsyncSession, challenge_id: str) -> Row:
+    """Atomically mark an unused, unexpired challenge as used (one-time use - replay protection).
+
+    A single UPDATE ... RETURNING both validates and claims the challenge, so
+    two concurrent submissions can never both pass. Returns the (id, steps) row.
     """
-    # 1. Validate challenge exists and is not expired/used
     result = await db.execute(
-        select(Challenge).where(Challenge.id == body.challenge_id)
+        update(Challenge)
+        .where(
+            Challenge.id == challenge_id,
+            Challenge.used == False,  # noqa: E712
+            Challenge.expires_at > func.now(),
+        )
+        .values(used=True)
+        .returning(Challenge.id, Challenge.steps)
+    )
+    claimed = result.first()
+    if claimed is not None:
+        return claimed
+
+    # Nothing was claimed – look the challenge up only to report why
+    result = await db.execute(
+        select(Challenge.used).where(Challenge.id == challenge_id)
     )
-    challenge = result.scalar_one_or_none()
+    row = result.first()
 
-    if challenge is None:
+    if row is None:
         raise HTTPException(status_code=404, detail="Challenge not found")
 
-    if challenge.used:
+    if row.used:
         raise HTTPException(status_code=410, detail="Challenge already used (replay protection)")
 
-    if challenge.expires_at < datetime.now(timezone.utc):
-        raise HTTPException(status_code=410, detail="Challenge expired")
+    raise HTTPException(status_code=410, detail="Challenge expired")
 
-    # 2. Mark challenge as used (one-time use - replay protection)
-    challenge.used = True
 
-    # 3. Run CV pipeline (CPU-bound → run in thread pool to avoid blocking)
-    cv_result = await asyncio.to_thread(analyze_frames, body.frames, challenge.steps)
+async def _verify_frames(
+    challenge: Row,
+    frames: List[bytes],
+    request: Request,
+    db: AsyncSession,
+) -> VerifyResponse:
+    """Run the CV pipeline on encoded frames, record the attempt and issue a token on success."""
+    # CPU-bound → run in thread pool to avoid blocking
+    cv_result = await asyncio.to_thread(analyze_frames, frames, challenge.steps)
 
-    # 4. Store verification attempt
+    # Store verification attempt
     attempt = VerificationAttempt(
         challenge_id=challenge.id,
         liveness_score=cv_result["liveness_score"],
@@ -151,25 +168,30 @@ async def verify_liveness(
         user_agent=request.headers.get("user-agent"),
         details=cv_result["step_results"],
     )
-    db.add(attempt)
+    new_rows = [attempt]
 
-    # 5. Issue token on success
+    # Issue token on success
     token_str = None
     token_expires = None
     if cv_result["passed"]:
+        now = datetime.now(timezone.utc)
         token_str, expires_at = create_access_token(
             subject=f"verified-user-{challenge.id}",
             extra_claims={"liveness_score": cv_result["liveness_score"]},
+            now=now,
         )
         # Store token hash in DB
         db_token = AccessToken(
             token_hash=hash_token(token_str),
             user_label=f"Challenge {str(challenge.id)[:8]}",
+            issued_at=now,
             expires_at=expires_at,
         )
-        db.add(db_token)
+        new_rows.append(db_token)
         token_expires = expires_at.isoformat()
 
+    # Both INSERTs go out in the same flush
+    db.add_all(new_rows)
     await db.flush()
 
     return VerifyResponse(
@@ -181,9 +203,51 @@ async def verify_liveness(
         temporal_valid=cv_result["temporal_valid"],
         token=token_str,
         token_expires_at=token_expires,
+        error=cv_result.get("error"),
     )
 
 
+@router.post("/verify", response_model=VerifyResponse)
+async def verify_liveness(
+    body: VerifyRequest,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+):
+    """Verify liveness by analyzing frames against a challenge.
+    
+    Accepts a challenge_id and a sequence of base64-encoded video frames.
+    Runs the CV pipeline to detect challenge actions in temporal order.
+    On success, issues a short-lived JWT access token.
+    Kept for backward compatibility – prefer `POST /verify/upload`.
+    """
+    challenge = await _claim_challenge(db, body.challenge_id)
+    frames = await asyncio.to_thread(decode_base64_frames, body.frames)
+    return await _verify_frames(challenge, frames, request, db)
+
+
+@router.post("/verify/upload", response_model=VerifyResponse)
+async def verify_liveness_upload(
+    request: Request,
+    challenge_id: str = Form(...),
+    frames: List[UploadFile] = File(..., description="Raw JPEG frames in capture order"),
+    db: AsyncSession = Depends(get_db),
+):
+    """Verify liveness from a multipart/form-data upload of raw JPEG frames.
+    
+    Same contract as `POST /verify`, but frames are streamed as binary parts
+    instead of base64 strings inside a JSON body.
+    """
+    if len(frames) > MAX_VERIFY_FRAMES:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"At most {MAX_VERIFY_FRAMES} frames are allowed",
+        )
+
+    challenge = await _claim_challenge(db, challenge_id)
+    frame_bytes = [await f.read() for f in frames]
+    return await _verify_frames(challenge, frame_bytes, request, db)
+
+
 @router.get("/protected", response_model=ProtectedResponse)
 async def protected_resource(user: dict = Depends(get_current_user)):
     """Protected endpoint – requires a valid, unexpired JWT token.
@@ -199,6 +263,18 @@ async def protected_resource(user: dict = Depends(get_current_user)):
     )
 
 
+def _fast_static_reject(frames: List[bytes]) -> Optional[str]:
+    """Reject obvious static-image attacks without running the CV pipeline."""
+    if is_static_sequence(frames):
+        return "No temporal variation detected — likely a static image"
+    return None
+
+
+def _sim_rejection(reason: str) -> dict:
+    """Attack-sim result for inputs rejected before the CV pipeline."""
+    return {"passed": False, "liveness_score": 0.0, "step_results": [], "error": reason}
+
+
 @router.post("/attack-sim", response_model=AttackSimResponse)
 async def attack_simulation(body: AttackSimRequest):
     """Attack simulation endpoint.
@@ -210,10 +286,29 @@ async def attack_simulation(body: AttackSimRequest):
     # Use a fixed challenge covering all actions
     sim_steps = ["blink", "turn_right", "smile"]
 
-    cv_result = analyze_frames(body.frames, sim_steps)
+    min_frames = len(sim_steps) * settings.MIN_CONSECUTIVE_FRAMES
+    if len(body.frames) < min_frames:
+        # Cannot complete the challenge – skip decoding and the CV pipeline
+        cv_result = _sim_rejection(
+            f"Too few frames ({len(body.frames)}) to perform {len(sim_steps)} gestures"
+        )
+    else:
+        frames = await asyncio.to_thread(decode_base64_frames, body.frames)
+        static_reason = await asyncio.to_thread(_fast_static_reject, frames)
+        if static_reason:
+            cv_result = _sim_rejection(static_reason)
+        else:
+            # Attack input is arbitrary, so don't assume temporal coherence for
+            # tracking; examine every frame so the rejection reason below covers
+            # the whole sequence.
+            cv_result = await asyncio.to_thread(
+                analyze_frames, frames, sim_steps, tracking=False, stop_early=False
+            )
 
     # Determine rejection reason
-    if cv_result["face_detected_count"] == 0:
+    if cv_result.get("error"):
+        reason = cv_result["error"]
+    elif cv_result["face_detected_count"] == 0:
         reason = "No face detected in any frame"
     elif not cv_result["temporal_valid"]:
         reason = "No temporal variation detected — likely a static image"
@@ -34,6 +34,8 @@ class Settings(BaseSettings):
     MAR_THRESHOLD: float = 0.55
     HEAD_TURN_THRESHOLD: float = 0.035  # Normalized ratio
     MIN_CONSECUTIVE_FRAMES: int = 2
+    DETECTION_STRIDE: int = 1  # Run Face Mesh on every Nth frame, reuse landmarks in between
+    FACE_LANDMARKER_MODEL: str = ""  # Path to a face_landmarker.task bundle; empty = legacy Face Mesh
 
     model_config = {"env_file": ".env", "extra": "ignore"}
 
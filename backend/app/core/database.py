@@ -1,5 +1,6 @@
 """Async SQLAlchemy database engine and session management."""
 
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import DeclarativeBase
 from app.core.config import get_settings
@@ -39,3 +40,14 @@ async def init_db():
     async with engine.begin() as conn:
         from app.models.models import Challenge, VerificationAttempt, AccessToken  # noqa
         await conn.run_sync(Base.metadata.create_all)
+
+        # create_all skips existing tables, so bring indexes on older
+        # databases up to date: the partial covering index replaces the
+        # plain token_hash index.
+        await conn.run_sync(
+            lambda sync_conn: [
+                index.create(sync_conn, checkfirst=True)
+                for index in AccessToken.__table__.indexes
+            ]
+        )
+        await conn.execute(text("DROP INDEX IF EXISTS ix_access_tokens_token_hash"))
@@ -1,29 +1,57 @@
 """JWT token creation, validation, and FastAPI auth dependency."""
 
+import asyncio
+import base64
 import hashlib
+import hmac
+import logging
+import time
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
+import asyncpg
+import blake3
+import orjson
+from cachetools import TTLCache
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
+from jose.exceptions import ExpiredSignatureError
 from sqlalchemy import select
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import get_settings
 from app.core.database import get_db
 
+logger = logging.getLogger(__name__)
 settings = get_settings()
 security_scheme = HTTPBearer()
 
+# token_hash -> expires_at for tokens recently confirmed active in the DB.
+# Entries are dropped on `NOTIFY revocations, '<token_hash>'` (see
+# start_revocation_listener) and otherwise go stale after 30s at most.
+REVOCATION_CHANNEL = "revocations"
+_token_cache: TTLCache = TTLCache(maxsize=10_000, ttl=30)
 
-def create_access_token(subject: str, extra_claims: Optional[dict] = None) -> tuple[str, datetime]:
-    """Create a JWT access token. Returns (token_string, expiry_datetime)."""
-    expires = datetime.now(timezone.utc) + timedelta(minutes=settings.JWT_EXPIRY_MINUTES)
+_SECRET_BYTES = settings.JWT_SECRET.encode()
+
+
+def create_access_token(
+    subject: str,
+    extra_claims: Optional[dict] = None,
+    now: Optional[datetime] = None,
+) -> tuple[str, datetime]:
+    """Create a JWT access token. Returns (token_string, expiry_datetime).
+
+    `now` is used for both `iat` and `exp`; defaults to the current time.
+    """
+    now = now or datetime.now(timezone.utc)
+    expires = now + timedelta(minutes=settings.JWT_EXPIRY_MINUTES)
     payload = {
         "sub": subject,
         "exp": expires,
-        "iat": datetime.now(timezone.utc),
+        "iat": now,
     }
     if extra_claims:
         payload.update(extra_claims)
@@ -31,9 +59,51 @@ def create_access_token(subject: str, extra_claims: Optional[dict] = None) -> tu
     return token, expires
 
 
+def _b64url_decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def _verify_hs256(token: str, secret: bytes) -> dict:
+    """Verify an HS256 JWT without python-jose's generic decode machinery.
+
+    Checks the signature in constant time plus the exp/nbf/iat claims, and
+    raises the same JWTError family as `jwt.decode`.
+    """
+    try:
+        signing_input, _, signature = token.rpartition(".")
+        header_b64, _, payload_b64 = signing_input.partition(".")
+        if not header_b64 or not payload_b64 or "." in payload_b64:
+            raise JWTError("Not enough segments")
+        header = orjson.loads(_b64url_decode(header_b64))
+        payload = orjson.loads(_b64url_decode(payload_b64))
+        expected = hmac.new(secret, signing_input.encode("ascii"), hashlib.sha256).digest()
+        valid_signature = hmac.compare_digest(expected, _b64url_decode(signature))
+    except ValueError as e:
+        raise JWTError(f"Invalid token format: {e}")
+
+    if not isinstance(header, dict) or header.get("alg") != "HS256":
+        raise JWTError("The specified alg value is not allowed")
+    if not valid_signature:
+        raise JWTError("Signature verification failed.")
+    if not isinstance(payload, dict):
+        raise JWTError("Invalid payload string: must be a json object")
+
+    now = time.time()
+    for claim in ("exp", "nbf", "iat"):
+        if claim in payload and not isinstance(payload[claim], (int, float)):
+            raise JWTError(f"{claim.upper()} claim must be a number.")
+    if "exp" in payload and payload["exp"] < now:
+        raise ExpiredSignatureError("Signature has expired.")
+    if "nbf" in payload and payload["nbf"] > now:
+        raise JWTError("The token is not yet valid (nbf)")
+    return payload
+
+
 def verify_token(token: str) -> dict:
     """Decode and verify a JWT token. Raises on failure."""
     try:
+        if settings.JWT_ALGORITHM == "HS256":
+            return _verify_hs256(token, _SECRET_BYTES)
         payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
         return payload
     except JWTError as e:
@@ -44,8 +114,18 @@ def verify_token(token: str) -> dict:
         )
 
 
+# Marks BLAKE3 digests so they can't be confused with legacy SHA-256 rows;
+# the prefix + 62 hex chars still fits AccessToken.token_hash (String(64)).
+_HASH_PREFIX = "b$"
+
+
 def hash_token(token: str) -> str:
-    """SHA-256 hash of a token for safe storage."""
+    """BLAKE3 hash of a token for safe storage."""
+    return _HASH_PREFIX + blake3.blake3(token.encode()).hexdigest()[:62]
+
+
+def legacy_hash_token(token: str) -> str:
+    """SHA-256 hash used for tokens issued before the switch to BLAKE3."""
     return hashlib.sha256(token.encode()).hexdigest()
 
 
@@ -57,25 +137,119 @@ async def get_current_user(
     token = credentials.credentials
     payload = verify_token(token)
 
-    # Check if token is revoked in DB
-    from app.models.models import AccessToken
+    # Check if token is revoked in DB (skipped while the cache vouches for it)
     token_h = hash_token(token)
-    result = await db.execute(
-        select(AccessToken).where(
-            AccessToken.token_hash == token_h,
-            AccessToken.revoked == False,  # noqa: E712
-        )
-    )
-    db_token = result.scalar_one_or_none()
-    if db_token is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Token not found or has been revoked",
+    expires_at = _token_cache.get(token_h)
+    if expires_at is None:
+        from app.models.models import AccessToken
+        # Legacy SHA-256 rows stay valid until they expire (JWT_EXPIRY_MINUTES)
+        # Only columns covered by ix_access_tokens_active (index-only scan)
+        result = await db.execute(
+            select(AccessToken.token_hash, AccessToken.expires_at).where(
+                AccessToken.token_hash.in_([token_h, legacy_hash_token(token)]),
+                AccessToken.revoked == False,  # noqa: E712
+            )
         )
-    if db_token.expires_at < datetime.now(timezone.utc):
+        row = result.first()
+        if row is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Token not found or has been revoked",
+            )
+        stored_hash, expires_at = row
+        # Cache under the stored hash only, so revocation NOTIFYs can evict it,
+        # and only while the revocation listener is connected to deliver them
+        if stored_hash == token_h and _revocation_conn is not None:
+            _token_cache[token_h] = expires_at
+
+    # Checked on every hit, so a cached entry never outlives the token itself
+    if expires_at < datetime.now(timezone.utc):
+        _token_cache.pop(token_h, None)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token has expired",
         )
 
     return payload
+
+
+def _on_revocation(connection, pid, channel, payload) -> None:
+    """asyncpg NOTIFY callback – the payload is the revoked token's hash."""
+    _token_cache.pop(payload, None)
+
+
+# Dedicated LISTEN connection; None while reconnecting or after shutdown.
+_revocation_conn: Optional[asyncpg.Connection] = None
+_reconnect_task: Optional[asyncio.Task] = None
+_RECONNECT_MAX_DELAY_S = 30.0
+
+
+async def _connect_revocation_listener() -> asyncpg.Connection:
+    dsn = make_url(settings.DATABASE_URL).set(drivername="postgresql")
+    conn = await asyncpg.connect(dsn.render_as_string(hide_password=False))
+    await conn.add_listener(REVOCATION_CHANNEL, _on_revocation)
+    conn.add_termination_listener(_on_revocation_listener_lost)
+    return conn
+
+
+def _on_revocation_listener_lost(connection) -> None:
+    """asyncpg termination callback – fail safe and start reconnecting."""
+    global _revocation_conn, _reconnect_task
+    if connection is not _revocation_conn:
+        return  # Closed on shutdown
+    _revocation_conn = None
+    # NOTIFYs may be missed from here on, so stop trusting cached tokens
+    _token_cache.clear()
+    logger.error(
+        "Token revocation listener lost its connection; "
+        "token cache disabled until it reconnects"
+    )
+    _reconnect_task = asyncio.get_running_loop().create_task(_reconnect_revocation_listener())
+
+
+async def _reconnect_revocation_listener() -> None:
+    global _revocation_conn
+    delay = 1.0
+    while True:
+        try:
+            conn = await _connect_revocation_listener()
+        except Exception as e:
+            logger.warning(f"Revocation listener reconnect failed, retrying in {delay:.0f}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, _RECONNECT_MAX_DELAY_S)
+            continue
+        _revocation_conn = conn
+        logger.info(f"Revocation listener reconnected on '{REVOCATION_CHANNEL}'")
+        return
+
+
+async def start_revocation_listener() -> None:
+    """Open a dedicated connection that evicts cached tokens on revocation.
+
+    Anything that sets `AccessToken.revoked` must also
+    `NOTIFY revocations, '<token_hash>'`. If the connection can't be opened or
+    later drops, the token cache is bypassed until it has been (re-)established
+    in the background – startup never fails on it.
+    """
+    global _revocation_conn, _reconnect_task
+    try:
+        _revocation_conn = await _connect_revocation_listener()
+    except Exception as e:
+        logger.error(
+            f"Token revocation listener failed to connect; "
+            f"token cache disabled until it connects: {e}"
+        )
+        _reconnect_task = asyncio.get_running_loop().create_task(_reconnect_revocation_listener())
+        return
+    logger.info(f"Listening for token revocations on '{REVOCATION_CHANNEL}'")
+
+
+async def stop_revocation_listener() -> None:
+    """Close the revocation listener (and any pending reconnect) on shutdown."""
+    global _revocation_conn, _reconnect_task
+    conn, _revocation_conn = _revocation_conn, None
+    if _reconnect_task is not None:
+        _reconnect_task.cancel()
+        _reconnect_task = None
+    if conn is not None:
+        await conn.close()
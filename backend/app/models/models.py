@@ -3,7 +3,7 @@
 import uuid
 from datetime import datetime, timezone
 
-from sqlalchemy import Boolean, Column, DateTime, Float, ForeignKey, String, Text
+from sqlalchemy import Boolean, Column, DateTime, Float, ForeignKey, Index, String, Text, text
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 
@@ -39,9 +39,19 @@ class VerificationAttempt(Base):
 
 class AccessToken(Base):
     __tablename__ = "access_tokens"
+    __table_args__ = (
+        # Auth lookup (token_hash = ? AND revoked = false, reading expires_at)
+        # is answered by an index-only scan.
+        Index(
+            "ix_access_tokens_active",
+            "token_hash",
+            postgresql_where=text("revoked = false"),
+            postgresql_include=["expires_at"],
+        ),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    token_hash = Column(String(64), nullable=False, index=True)
+    token_hash = Column(String(64), nullable=False)
     user_label = Column(String(255), nullable=True)
     issued_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
     expires_at = Column(DateTime(timezone=True), nullable=False)
@@ -1,8 +1,8 @@
 """Challenge generation service."""
 
-import random
+import secrets
 from datetime import datetime, timedelta, timezone
-from typing import List
+from typing import List, Optional
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -18,20 +18,28 @@ CHALLENGE_POOL = ["blink", "turn_left", "turn_right", "smile", "brow_raise", "to
 def generate_challenge_steps(count: int = 3) -> List[str]:
     """Generate a random sequence of unique challenge steps.
     
-    Returns a list of `count` randomly selected unique gestures.
+    Returns a list of `count` randomly selected unique gestures. Uses the OS
+    CSPRNG (one byte per pick) so sequences can't be predicted in advance.
     """
     if count > len(CHALLENGE_POOL):
         count = len(CHALLENGE_POOL)
-    return random.sample(CHALLENGE_POOL, count)
+    rand = secrets.token_bytes(count)
+    pool = list(CHALLENGE_POOL)
+    return [pool.pop(b % len(pool)) for b in rand]
 
 
-async def create_challenge(db: AsyncSession) -> Challenge:
-    """Create and persist a new challenge in the database."""
+async def create_challenge(db: AsyncSession, now: Optional[datetime] = None) -> Challenge:
+    """Create and persist a new challenge in the database.
+
+    `now` lets the caller share one request timestamp; defaults to the current time.
+    """
+    now = now or datetime.now(timezone.utc)
     steps = generate_challenge_steps(3)
-    expires_at = datetime.now(timezone.utc) + timedelta(seconds=settings.CHALLENGE_EXPIRY_SECONDS)
+    expires_at = now + timedelta(seconds=settings.CHALLENGE_EXPIRY_SECONDS)
 
     challenge = Challenge(
         steps=steps,
+        created_at=now,
         expires_at=expires_at,
     )
     db.add(challenge)
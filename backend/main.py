@@ -1,5 +1,6 @@
 """FastAPI application entry point for Proof-of-Life Authentication System."""
 
+import asyncio
 import logging
 from contextlib import asynccontextmanager
 
@@ -8,7 +9,9 @@ from fastapi.middleware.cors import CORSMiddleware
 
 from app.core.config import get_settings
 from app.core.database import init_db
+from app.core.security import start_revocation_listener, stop_revocation_listener
 from app.api.routes import router
+from app.services.vision import warm_up
 
 settings = get_settings()
 
@@ -22,12 +25,15 @@ async def lifespan(app: FastAPI):
     logger.info("🚀 Starting Proof-of-Life backend...")
     await init_db()
     logger.info("✅ Database tables created/verified")
+    await start_revocation_listener()
 
-    # Pre-warm MediaPipe (lazy init on first request, but log it)
-    logger.info("🧠 MediaPipe Face Mesh will initialize on first request")
+    # Pre-warm MediaPipe so the first verification doesn't pay graph init
+    await asyncio.to_thread(warm_up)
+    logger.info("🧠 MediaPipe Face Mesh initialized on all vision workers")
 
     yield
 
+    await stop_revocation_listener()
     logger.info("👋 Shutting down Proof-of-Life backend")
 
 
@@ -70,6 +76,7 @@ async def root():
         "endpoints": {
             "challenge": "POST /api/challenge",
             "verify": "POST /api/verify",
+            "verify_upload": "POST /api/verify/upload",
             "protected": "GET /api/protected",
             "attack_sim": "POST /api/attack-sim",
             "health": "GET /api/health",
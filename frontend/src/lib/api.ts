@@ -62,13 +62,15 @@ export async function submitVerification(
     challengeId: string,
     frames: string[]
 ): Promise<VerifyResponse> {
-    const res = await fetch(`${API_BASE}/api/verify`, {
+    // Send raw JPEG bytes as multipart parts instead of base64 inside JSON
+    const blobs = await Promise.all(frames.map((frame) => fetch(frame).then((r) => r.blob())));
+    const form = new FormData();
+    form.append("challenge_id", challengeId);
+    blobs.forEach((blob, i) => form.append("frames", blob, `frame-${i}.jpg`));
+
+    const res = await fetch(`${API_BASE}/api/verify/upload`, {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({
-            challenge_id: challengeId,
-            frames,
-        }),
+        body: form,
     });
     if (!res.ok) {
         const err = await res.json().catch(() => ({ detail: "Verification failed" }));